@@ -0,0 +1,200 @@
+"""
+A local index of the URLs in my browser history, each stored once with when
+I last visited it and its description, so pickers (the recent-history and
+history_fzf scripts) can stream them most-recent-first without reading
+every visit
+
+Visits from active Firefox databases are merged in by visit id, so each update
+only reads visits newer than the last one. Other databases (e.g. my.browser.export
+backups) are merged in once, and again only if they change
+
+The index is kept in the HPI cache directory (browser/url_index.sqlite).
+Callers which only want some of my history (e.g. recent-history, which only
+picks from my live Firefox database) keep a separately named index, see connect
+"""
+
+REQUIRES = ["browserexport", "sqlite_backup"]
+
+import os
+import json
+import sqlite3
+from pathlib import Path
+from urllib.parse import unquote
+from collections.abc import Iterator, Iterable, Sequence
+
+from my.core import make_logger
+from my.utils.cache import cache_db
+
+logger = make_logger(__name__)
+
+# (url, visit time in microseconds, description)
+_Row = tuple[str, int, str | None]
+
+# keep the description from the most recent visit, if it has one
+_MERGE = """
+INSERT INTO urls VALUES (?, ?, ?) ON CONFLICT(url) DO UPDATE SET
+    last_visit = max(last_visit, excluded.last_visit),
+    description = CASE WHEN excluded.last_visit >= last_visit
+        THEN coalesce(excluded.description, description)
+        ELSE coalesce(description, excluded.description) END
+"""
+
+# like browserexport's Firefox schema, on mobile visit_date is in milliseconds
+_FIREFOX_VISITS = """
+SELECT V.id, P.url,
+    (CASE WHEN (V.visit_date > 300000000 * 1000000) THEN V.visit_date ELSE V.visit_date * 1000 END),
+    P.description
+FROM moz_historyvisits as V, moz_places as P
+WHERE V.place_id = P.id AND V.id > ?
+ORDER BY V.id
+"""
+
+
+def connect(name: str = "url_index") -> sqlite3.Connection:
+    conn = cache_db("browser", f"{name}.sqlite")
+    with conn:
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS urls (url TEXT PRIMARY KEY, last_visit INTEGER, description TEXT)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS urls_last_visit ON urls (last_visit)")
+        # for active databases, 'visit_id' is the last visit merged in
+        # for others, 'size'/'mtime_ns' are what the file was when it was merged
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS sources (path TEXT PRIMARY KEY, visit_id INTEGER, size INTEGER, mtime_ns INTEGER)"
+        )
+    return conn
+
+
+def _merge(conn: sqlite3.Connection, rows: Iterable[_Row]) -> None:
+    conn.executemany(_MERGE, rows)
+
+
+def _open_active(path: Path) -> sqlite3.Connection:
+    """
+    Opens the database read-only in place. If the browser has it locked,
+    falls back to copying it with sqlite_backup
+    """
+    conn = sqlite3.connect(f"{path.absolute().as_uri()}?mode=ro", uri=True)
+    try:
+        conn.execute("SELECT count(*) FROM sqlite_master").fetchone()
+        return conn
+    except sqlite3.OperationalError as e:
+        conn.close()
+        if "locked" not in str(e):
+            raise
+    from sqlite_backup import sqlite_backup
+
+    logger.debug(f"{path} is locked, copying it")
+    backup = sqlite_backup(path)
+    assert backup is not None
+    return backup
+
+
+def _is_firefox(db: sqlite3.Connection) -> bool:
+    return (
+        db.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'moz_historyvisits'"
+        ).fetchone()
+        is not None
+    )
+
+
+def update_active(conn: sqlite3.Connection, paths: Sequence[Path]) -> None:
+    """
+    Merges any visits from these Firefox databases which are newer than the
+    last update. Databases from other browsers are merged like update_files
+    """
+    for path in paths:
+        row = conn.execute(
+            "SELECT visit_id FROM sources WHERE path = ?", (str(path),)
+        ).fetchone()
+        last_id: int = row[0] if row is not None and row[0] is not None else 0
+        rows: list[_Row] = []
+        db = _open_active(path)
+        try:
+            if not _is_firefox(db):
+                update_files(conn, [path])
+                continue
+            (max_id,) = db.execute("SELECT max(id) FROM moz_historyvisits").fetchone()
+            # the database was recreated, ids started over. merging is
+            # idempotent, so its fine to go through everything again
+            if max_id is None or max_id < last_id:
+                last_id = 0
+            for visit_id, url, visit_date, description in db.execute(
+                _FIREFOX_VISITS, (last_id,)
+            ):
+                rows.append((unquote(url), visit_date, description))
+                last_id = visit_id
+        finally:
+            db.close()
+        logger.debug(f"merging {len(rows)} new visits from {path}")
+        with conn:
+            _merge(conn, rows)
+            conn.execute(
+                "INSERT OR REPLACE INTO sources VALUES (?, ?, NULL, NULL)",
+                (str(path), last_id),
+            )
+
+
+def update_files(conn: sqlite3.Connection, paths: Sequence[Path]) -> None:
+    """
+    Merges databases/exports which are new or changed since
+    the last update, using browserexport to parse them
+    """
+    from browserexport.parse import read_visits
+
+    for path in paths:
+        st = path.stat()
+        row = conn.execute(
+            "SELECT size, mtime_ns FROM sources WHERE path = ?", (str(path),)
+        ).fetchone()
+        if row is not None and tuple(row) == (st.st_size, st.st_mtime_ns):
+            continue
+        logger.debug(f"merging {path}")
+        with conn:
+            _merge(
+                conn,
+                (
+                    (
+                        v.url,
+                        int(v.dt.timestamp() * 1_000_000),
+                        v.metadata.description if v.metadata is not None else None,
+                    )
+                    for v in read_visits(path)
+                ),
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO sources VALUES (?, NULL, ?, ?)",
+                (str(path), st.st_size, st.st_mtime_ns),
+            )
+
+
+def urls(conn: sqlite3.Connection) -> Iterator[tuple[str, str | None]]:
+    """(url, description), most recently visited first"""
+    yield from conn.execute(
+        "SELECT url, description FROM urls ORDER BY last_visit DESC"
+    )
+
+
+def update(conn: sqlite3.Connection) -> None:
+    """Updates the index from my.browser.active_browser and my.browser.export"""
+    from my.browser import active_browser, export
+
+    update_active(conn, active_browser.inputs())
+    update_files(conn, export.inputs())
+
+
+if __name__ == "__main__":
+    # print "url|description" as JSON strings, for history_fzf
+    import sys
+
+    conn = connect()
+    update(conn)
+    try:
+        for url, description in urls(conn):
+            sys.stdout.write(json.dumps(f"{url}|{description or ''}"))
+            sys.stdout.write("\n")
+        sys.stdout.flush()
+    except BrokenPipeError:
+        # fzf exited before reading everything
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
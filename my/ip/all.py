@@ -4,10 +4,14 @@ Combines IPs from data exports which include IP addresses
 
 REQUIRES = ["ipgeocache"]
 
-from collections.abc import Iterator
+import os
+from datetime import datetime
+from typing import Any, NamedTuple
+from concurrent.futures import ThreadPoolExecutor
+from collections.abc import Iterator, Iterable
 
 from my.ip.common import IP
-from my.core import make_logger, Stats
+from my.core import make_logger, Stats, Json
 from my.core.denylist import DenyList
 
 logger = make_logger(__name__)
@@ -30,10 +34,98 @@ def _ips() -> Iterator[IP]:
 
 
 def ips() -> Iterator[IP]:
-    yield from deny.filter(_ips())
+    deny_map = deny.load()
+    # the denylist is typically only keyed by addr, in which case we can
+    # skip DenyList.filter (which serializes each value) and just check the set
+    if set(deny_map) <= {"addr"}:
+        denied = frozenset(deny_map.get("addr", ()))
+        yield from (ip for ip in _ips() if ip.addr not in denied)
+    else:
+        yield from deny.filter(_ips())
+
+
+class UniqueIP(NamedTuple):
+    addr: str
+    first_seen: datetime
+    last_seen: datetime
+    occurrences: int
+
+
+def unique_ips() -> Iterator[UniqueIP]:
+    """
+    Collapses repeated IPs into one record each, sorted by when they were first seen
+    """
+    # addr -> [first_seen, last_seen, occurrences]
+    seen: dict[str, list[Any]] = {}
+    for ip in ips():
+        u = seen.get(ip.addr)
+        if u is None:
+            seen[ip.addr] = [ip.dt, ip.dt, 1]
+        else:
+            if ip.dt < u[0]:
+                u[0] = ip.dt
+            elif ip.dt > u[1]:
+                u[1] = ip.dt
+            u[2] += 1
+    for addr, (first, last, occurrences) in sorted(
+        seen.items(), key=lambda kv: kv[1][0]
+    ):
+        yield UniqueIP(addr, first, last, occurrences)
+
+
+# how many requests to make to ipinfo at once, for IPs which aren't cached
+GEOLOCATE_WORKERS = int(os.environ.get("HPI_IPGEOCACHE_WORKERS", 4))
+
+
+def geolocate(addrs: Iterable[str]) -> dict[str, Json]:
+    """
+    Geolocates each unique address once. Reads everything already in the
+    ipgeocache directory first, then requests the rest in a thread pool
+    """
+    import ipgeocache
+
+    cache_dir = ipgeocache.get_cache_dir()
+    res: dict[str, Json] = {}
+    missing: list[str] = []
+    for addr in set(addrs):
+        _, info = ipgeocache.get_from_cache(addr, cache_dir, None)
+        if info is None:
+            missing.append(addr)
+        else:
+            res[addr] = info
+    if not missing:
+        return res
+
+    logger.info(f"requesting geolocation for {len(missing)} uncached IPs")
+    token = ipgeocache.get_token()
+
+    def _request(addr: str) -> Json | None:
+        try:
+            info: Json = ipgeocache.get_from_cache_or_request(
+                addr, token, cache_dir, None
+            )
+            return info
+        except Exception as e:
+            logger.warning(f"could not geolocate {addr}: {e}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=GEOLOCATE_WORKERS) as pool:
+        for addr, info in zip(missing, pool.map(_request, missing)):
+            if info is not None:
+                res[addr] = info
+    return res
+
+
+def geolocated() -> Iterator[tuple[UniqueIP, Json]]:
+    """Unique IPs with their ipgeocache info, skipping any which couldn't be geolocated"""
+    uips = list(unique_ips())
+    info = geolocate(u.addr for u in uips)
+    for u in uips:
+        if u.addr in info:
+            yield u, info[u.addr]
 
 
 def stats() -> Stats:
     from my.core import stat
 
-    return {**stat(ips)}
+    return {**stat(ips), **stat(unique_ips)}
@@ -0,0 +1,60 @@
+"""
+Merged listens (music) from all my sources, using https://github.com/purarue/my_feed
+"""
+
+REQUIRES = ["hpi-feed"]
+
+import time
+import heapq
+from collections.abc import Iterator, Callable
+
+from my_feed.sources.model import FeedItem
+from my_feed.transform import transform
+from my_feed.sources import listens, mpv, facebook_spotify_listens, offline_listens
+
+from my.core import Stats
+
+# name -> function which returns listens. none of these are reliably sorted,
+# e.g. mpv.history is only roughly chronological if I had several mpv
+# instances open at once, so recent filters and sorts each one
+SOURCES: dict[str, Callable[[], Iterator[FeedItem]]] = {
+    # chains several full exports together
+    "listenbrainz": transform(listens.history),
+    "mpv": transform(mpv.history),
+    "facebook_spotify_listens": transform(facebook_spotify_listens.history),
+    "offline_listens": offline_listens.history,
+}
+
+
+def history() -> Iterator[FeedItem]:
+    for func in SOURCES.values():
+        yield from func()
+
+
+def _in_range(itr: Iterator[FeedItem], start: float, end: float) -> list[FeedItem]:
+    """items in [start, end), oldest first"""
+    res = [
+        item
+        for item in itr
+        if not isinstance(item, Exception) and start <= item.when.timestamp() < end
+    ]
+    res.sort(key=lambda item: item.when)
+    return res
+
+
+def recent(within: float) -> Iterator[FeedItem]:
+    """
+    Items from all sources in the last 'within' seconds, oldest first
+    """
+    end = time.time()
+    start = end - within
+    yield from heapq.merge(
+        *(_in_range(func(), start, end) for func in SOURCES.values()),
+        key=lambda item: item.when,
+    )
+
+
+def stats() -> Stats:
+    from my.core import stat
+
+    return {**stat(history)}
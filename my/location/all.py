@@ -1,8 +1,15 @@
 """
 Merges location data from multiple sources -- this includes apple location data as well
+
+Set HPI_LOCATION_PARALLEL=1 to parse each source in a separate process, which
+speeds up rebuilding the caches for all the sources on a multicore machine
 """
 
-from collections.abc import Iterator
+import os
+import heapq
+import multiprocessing
+from queue import Empty
+from collections.abc import Iterator, Callable
 
 from my.core import Stats, make_logger
 
@@ -12,15 +19,171 @@ from my.core.error import warn_exceptions
 
 from my.location.common import Location
 
-
 logger = make_logger(__name__, level="warning")
 
 
-def locations() -> Iterator[Location]:
+def _google_takeout_semantic() -> Iterator[Location]:
     yield from warn_exceptions(google_takeout_semantic.locations())
-    yield from google_takeout.locations()
-    yield from gpslogger.locations()
-    yield from apple.locations()
+
+
+# name -> (function which returns locations, whether those are already sorted by datetime)
+#
+# in sorted_locations, sources which are sorted are streamed. the others are each
+# sorted individually, and since heapq.merge starts every source at once, all of them
+# are in memory at the same time -- so they're filtered before they're sorted
+SOURCES: dict[str, tuple[Callable[[], Iterator[Location]], bool]] = {
+    "google_takeout_semantic": (_google_takeout_semantic, False),
+    "google_takeout": (google_takeout.locations, False),
+    "gpslogger": (gpslogger.locations, True),
+    "apple": (apple.locations, False),
+}
+
+
+# how many locations to send back from a worker process at a time
+BATCH_SIZE = 5000
+# how many batches each worker can have waiting before it blocks
+QUEUE_BATCHES = 20
+# how often (in seconds) to check that the workers are still alive
+QUEUE_POLL = 5
+
+
+def _use_parallel(parallel: bool | None) -> bool:
+    if parallel is not None:
+        return parallel
+    return os.environ.get("HPI_LOCATION_PARALLEL", "").lower() in {"1", "true", "yes"}
+
+
+# (source name, a batch of locations | an error | None when the source is done)
+_Message = tuple[str, list[Location] | Exception | None]
+
+
+def _source_worker(name: str, queue: "multiprocessing.Queue[_Message]") -> None:
+    """Runs in a separate process, sends batches of locations back to the parent"""
+    import more_itertools
+
+    func, _ = SOURCES[name]
+    try:
+        for batch in more_itertools.chunked(func(), BATCH_SIZE):
+            queue.put((name, batch))
+    except Exception as e:
+        # not every exception can be pickled, and if it can't the queue drops
+        # it without telling us, so send something that's known to work
+        queue.put((name, RuntimeError(f"{name}: {e!r}")))
+    queue.put((name, None))
+
+
+def _parallel(names: list[str]) -> Iterator[tuple[str, list[Location]]]:
+    """
+    Starts a process for each source, yielding (name, batch) as they arrive
+    Errors raised while loading the source are re-raised here
+    """
+    queue: "multiprocessing.Queue[_Message]" = multiprocessing.Queue(
+        maxsize=QUEUE_BATCHES * len(names)
+    )
+    procs = [
+        multiprocessing.Process(
+            target=_source_worker, args=(name, queue), name=name, daemon=True
+        )
+        for name in names
+    ]
+    for proc in procs:
+        proc.start()
+    remaining = set(names)
+    # workers which were dead and not done the last time the queue was empty
+    dead: set[str] = set()
+    try:
+        while remaining:
+            try:
+                name, batch = queue.get(timeout=QUEUE_POLL)
+            except Empty:
+                # a worker was killed (e.g. OOM) or its messages were dropped. it's
+                # only an error once it's been dead for a poll, since it may have
+                # sent its last messages right before exiting
+                if lost := dead & remaining:
+                    codes = {p.name: p.exitcode for p in procs if p.name in lost}
+                    raise RuntimeError(
+                        f"location workers exited without finishing (name -> exit code): {codes}"
+                    )
+                dead = {p.name for p in procs if not p.is_alive()}
+                continue
+            if batch is None:
+                remaining.discard(name)
+            elif isinstance(batch, Exception):
+                raise batch
+            else:
+                yield name, batch
+    finally:
+        for proc in procs:
+            if proc.is_alive():
+                proc.terminate()
+            proc.join()
+
+
+def _parallel_source(name: str) -> Iterator[Location]:
+    for _, batch in _parallel([name]):
+        yield from batch
+
+
+def locations(parallel: bool | None = None) -> Iterator[Location]:
+    if _use_parallel(parallel):
+        # order doesn't matter here, so just yield batches from any source as they come in
+        for _, batch in _parallel(list(SOURCES)):
+            yield from batch
+        return
+    for func, _ in SOURCES.values():
+        yield from func()
+
+
+def _sorted_source(
+    name: str,
+    itr: Iterator[Location],
+    is_sorted: bool,
+    predicate: Callable[[Location], bool] | None = None,
+) -> Iterator[Location]:
+    if predicate is not None:
+        itr = filter(predicate, itr)
+    if not is_sorted:
+        yield from sorted(itr, key=lambda loc: loc.dt)
+        return
+
+    # check that the source actually is sorted, warning if it isn't
+    out_of_order = 0
+    last = None
+    for loc in itr:
+        if last is not None and loc.dt < last:
+            out_of_order += 1
+        else:
+            last = loc.dt
+        yield loc
+    if out_of_order > 0:
+        logger.warning(
+            f"{name}: {out_of_order} locations were out of order, should be marked as unsorted in my.location.all.SOURCES"
+        )
+
+
+def sorted_locations(
+    parallel: bool | None = None,
+    predicate: Callable[[Location], bool] | None = None,
+) -> Iterator[Location]:
+    """
+    Locations from all sources, merged in datetime order
+
+    If predicate is passed, only locations it returns True for are kept. This is
+    checked before each source is sorted, so the rest never have to be in memory
+    """
+    use_parallel = _use_parallel(parallel)
+    yield from heapq.merge(
+        *(
+            _sorted_source(
+                name,
+                _parallel_source(name) if use_parallel else func(),
+                is_sorted,
+                predicate,
+            )
+            for name, (func, is_sorted) in SOURCES.items()
+        ),
+        key=lambda loc: loc.dt,
+    )
 
 
 def stats() -> Stats:
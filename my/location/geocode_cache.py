@@ -0,0 +1,164 @@
+"""
+A persistent cache for Nominatim geocoding, shared by my.location.where_db and
+the location-tag/distance-to scripts, so looking up the same places (e.g. home/work)
+is instant and isn't rate limited
+
+The sqlite database is kept in the HPI cache directory (location/geocode.sqlite).
+Reverse lookups are keyed by the lat/lon rounded to some precision. Configured
+with environment variables:
+
+HPI_GEOCODE_PRECISION: decimal places to round lat/lon to (default: 4, ~11m)
+HPI_GEOCODE_TTL_DAYS: how long cached answers are valid for (default: 180)
+HPI_GEOCODE_MAX_ENTRIES: remove least recently used entries past this (default: 50000)
+HPI_GEOCODE_OFFLINE: if set to 1, never make network requests, only use cached answers
+"""
+
+import os
+import json
+import time
+import sqlite3
+from pathlib import Path
+from typing import Any
+from collections.abc import Callable
+
+from my.utils.cache import cache_db
+
+# the raw JSON response from nominatim
+Raw = dict[str, Any]
+
+
+def _env_flag(name: str) -> bool:
+    return os.environ.get(name, "").lower() in {"1", "true", "yes"}
+
+
+# https://operations.osmfoundation.org/policies/nominatim/, at most one request per second
+_last_request: float = 0.0
+
+
+def _rate_limit() -> None:
+    global _last_request
+    wait = 1 - (time.monotonic() - _last_request)
+    if wait > 0:
+        time.sleep(wait)
+    _last_request = time.monotonic()
+
+
+class GeocodeCache:
+    def __init__(
+        self,
+        path: Path | None = None,
+        *,
+        precision: int | None = None,
+        ttl_days: float | None = None,
+        max_entries: int | None = None,
+        offline: bool | None = None,
+    ) -> None:
+        self.precision = (
+            precision
+            if precision is not None
+            else int(os.environ.get("HPI_GEOCODE_PRECISION", 4))
+        )
+        self.ttl = 86400 * (
+            ttl_days
+            if ttl_days is not None
+            else float(os.environ.get("HPI_GEOCODE_TTL_DAYS", 180))
+        )
+        self.max_entries = (
+            max_entries
+            if max_entries is not None
+            else int(os.environ.get("HPI_GEOCODE_MAX_ENTRIES", 50000))
+        )
+        self.offline = (
+            offline if offline is not None else _env_flag("HPI_GEOCODE_OFFLINE")
+        )
+        self.conn = (
+            sqlite3.connect(path)
+            if path is not None
+            else cache_db("location", "geocode.sqlite")
+        )
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS geocode (kind TEXT, key TEXT, value TEXT, created REAL, accessed REAL, PRIMARY KEY (kind, key))"
+            )
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS geocode_accessed ON geocode (accessed)"
+            )
+
+    def _get(self, kind: str, key: str) -> tuple[bool, Raw | None]:
+        row = self.conn.execute(
+            "SELECT value, created FROM geocode WHERE kind = ? AND key = ?",
+            (kind, key),
+        ).fetchone()
+        if row is None:
+            return False, None
+        value, created = row
+        now = time.time()
+        # if we're offline, stale answers are better than nothing
+        if not self.offline and now - created > self.ttl:
+            return False, None
+        with self.conn:
+            self.conn.execute(
+                "UPDATE geocode SET accessed = ? WHERE kind = ? AND key = ?",
+                (now, kind, key),
+            )
+        return True, json.loads(value)
+
+    def _put(self, kind: str, key: str, value: Raw | None) -> None:
+        now = time.time()
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO geocode VALUES (?, ?, ?, ?, ?)",
+                (kind, key, json.dumps(value), now, now),
+            )
+            # remove the least recently used entries past the limit
+            self.conn.execute(
+                "DELETE FROM geocode WHERE rowid IN (SELECT rowid FROM geocode ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def lookup(
+        self, kind: str, key: str, fetch: Callable[[], Raw | None]
+    ) -> Raw | None:
+        """
+        Returns the cached value for kind/key, else calls fetch and caches the result
+        If we're offline and this isn't cached, returns None
+        """
+        hit, value = self._get(kind, key)
+        if hit:
+            return value
+        if self.offline:
+            return None
+        _rate_limit()
+        value = fetch()
+        self._put(kind, key, value)
+        return value
+
+    def reverse(
+        self, lat: float, lon: float, *, user_agent: str, timeout: int = 10
+    ) -> Raw | None:
+        """Reverse geocode a lat/lon to an address"""
+
+        def _fetch() -> Raw | None:
+            import geopy.geocoders  # type: ignore[import]
+
+            nom = geopy.geocoders.Nominatim(user_agent=user_agent)
+            info = nom.reverse((lat, lon), timeout=timeout)  # type: ignore
+            return None if info is None else dict(info.raw)
+
+        key = f"{round(lat, self.precision):.{self.precision}f},{round(lon, self.precision):.{self.precision}f}"
+        return self.lookup("reverse", key, _fetch)
+
+    def geocode(self, query: str, *, user_agent: str, timeout: int = 10) -> Raw | None:
+        """Geocode a search query to a location"""
+
+        def _fetch() -> Raw | None:
+            import geopy.geocoders  # type: ignore[import]
+
+            nom = geopy.geocoders.Nominatim(user_agent=user_agent)
+            info = nom.geocode(query, timeout=timeout)  # type: ignore
+            return None if info is None else dict(info.raw)
+
+        return self.lookup("geocode", query.strip().casefold(), _fetch)
+
+    def close(self) -> None:
+        self.conn.close()
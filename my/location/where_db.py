@@ -1,33 +1,52 @@
 """
-Unrelated to the other sources here, uses locations to generate a data (JSON) file
+Unrelated to the other sources here, uses locations to generate a data file
 which tracks where I was on each hour/day, making it fast/easy to query from my phone
 
 This is all pretty messy, to make sense for using my data, it uses some (configurable through
 the config) heuristics, falling back to my.location.home if I don't have any data, and
 re-using old locations for holes in data sources
 
-In the background I run 'hpi query my.location.where_db.gen > ~/data/where_db.json' to save to a
-database once every few hours to update
+In the background I run 'python3 -m my.location.where_db gen -o ~/data/where_db.bin' to save to a
+database once every few hours to update. The default database format is a binary file of sorted,
+fixed-width (lat, lon, epoch) records which is memory-mapped and binary searched when querying.
+'hpi query my.location.where_db.gen' (or 'gen --format json') still works to export JSON
 
 Then 'python3 -m my.location.where_db query' accepts any sort of date-like string and queries the db
 printing the latitude/longitude.
 """
 
+import os
+import sys
 import json
 import time
-from collections import defaultdict
+import mmap
+import math
+import struct
+import bisect
+import threading
+import socketserver
+from collections import defaultdict, Counter
 from pathlib import Path
 from typing import (
+    Any,
+    TextIO,
+    Literal,
     NamedTuple,
+    cast,
+    get_args,
+    overload,
 )
 from collections.abc import Iterator, Mapping, Iterable, Sequence
 from functools import cache
 from datetime import datetime, date, timedelta
 from dataclasses import dataclass
 
-from my.core import make_config, PathIsh
+from my.core import make_config, make_logger, PathIsh
 from my.core.warnings import medium
 from my.location.common import Location, LatLon
+from my.location.where_db_client import default_socket_path
+from my.location.geocode_cache import GeocodeCache
+from my.utils.cache import atomic_write
 
 from my.config import location
 
@@ -64,9 +83,17 @@ class user_config(location.where_db):  # type: ignore
     # required to query to where you save the database
     database_location: PathIsh | None = None
 
+    # how to compute the distance between points when generating the database
+    # 'geodesic' is exact, 'haversine' is an approximation (up to ~0.5% off) which
+    # is vectorized with numpy, and is much faster on millions of points
+    # defaults to 'geodesic'
+    distance_method: str | None = None
+
 
 config = make_config(user_config)
 
+logger = make_logger(__name__)
+
 fts = datetime.fromtimestamp  # 'from timestamp'
 
 # just for loading/querying the database
@@ -89,39 +116,166 @@ def _serialize(loc: Location) -> ModelDt:
     return ModelDt(loc.lat, loc.lon, loc.dt)
 
 
-def generate_from_locations() -> Iterator[ModelDt]:
-    import geopy.distance  # type: ignore[import]
-    from my.location.all import locations as location_sources
+def _accurate_locations(
+    high_water_marks: dict[str, float] | None = None,
+) -> Iterator[Location]:
+    """
+    Locations which pass the accuracy filter, sorted by datetime
+
+    If high_water_marks (datasource -> epoch) is passed, only locations newer than
+    the mark for their source are returned, and the marks are updated in place
+    """
+    from my.location.all import sorted_locations as location_sources
 
     use_accuracy = config.accuracy_filter if config.accuracy_filter is not None else 300
+    # sources aren't always sorted, so compare against the marks we started with
+    after = dict(high_water_marks) if high_water_marks is not None else {}
+
+    # checked before each source is sorted, so locations we'd skip aren't held in memory
+    def _keep(loc: Location) -> bool:
+        if loc.accuracy is None or loc.accuracy >= use_accuracy:
+            return False
+        return loc.dt.timestamp() > after.get(
+            loc.datasource or "unknown", float("-inf")
+        )
+
+    for loc in location_sources(predicate=_keep):
+        if high_water_marks is not None:
+            source = loc.datasource or "unknown"
+            ts = loc.dt.timestamp()
+            if ts > high_water_marks.get(source, float("-inf")):
+                high_water_marks[source] = ts
+        yield loc
+
+
+DistanceMethod = Literal["geodesic", "haversine"]
+
+# mean earth radius (metres), same as geopy.distance.great_circle
+EARTH_RADIUS_M = 6371009.0
+
+
+def _distance_method(method: DistanceMethod | None = None) -> DistanceMethod:
+    if method is None:
+        method = cast(DistanceMethod, config.distance_method or "geodesic")
+    if method == "haversine":
+        try:
+            import numpy  # noqa: F401
+        except ImportError:
+            medium("numpy is not installed, falling back to geodesic distance")
+            return "geodesic"
+    assert method in get_args(DistanceMethod), f"Unknown distance method {method}"
+    return method
+
+
+def _decimate_thresholds() -> tuple[int, timedelta]:
     new_dist = (
         config.new_point_distance if config.new_point_distance is not None else 100
     )
-
-    locs: list[Location] = [
-        loc
-        for loc in location_sources()
-        if loc.accuracy is not None and loc.accuracy < use_accuracy
-    ]
-    locs.sort(key=lambda lc: lc.dt)
-    last: Location = locs[0]
-    yield _serialize(last)
     new_point_distance = (
         config.new_point_duration
         if config.new_point_duration is not None
         else timedelta(hours=3)
     )
     assert isinstance(new_point_distance, timedelta)
+    return new_dist, new_point_distance
 
-    for cur in locs[1:]:
+
+def _decimate(
+    locs: Iterable[Location],
+    last: ModelDt | None = None,
+    method: DistanceMethod | None = None,
+) -> Iterator[ModelDt]:
+    """
+    Given sorted locations, only emit points once we've moved far enough or
+    enough time has passed. If last is provided, continues from that point
+    instead of emitting the first location
+    """
+    if _distance_method(method) == "haversine":
+        yield from _decimate_haversine(locs, last)
+        return
+
+    import geopy.distance  # type: ignore[import]
+
+    new_dist, new_point_distance = _decimate_thresholds()
+
+    for cur in locs:
+        if last is None:
+            last = _serialize(cur)
+            yield last
+            continue
         last_latlon: LatLon = (last.lat, last.lon)
         cur_latlon: LatLon = (cur.lat, cur.lon)
         dist = geopy.distance.distance(last_latlon, cur_latlon)
         # if we've hit distance filter threshold, or we haven't
         # sent a location recently, send a new one
         if dist.m > new_dist or cur.dt - last.dt > new_point_distance:
-            yield _serialize(cur)
-            last = cur
+            last = _serialize(cur)
+            yield last
+
+
+def _decimate_haversine(
+    locs: Iterable[Location],
+    last: ModelDt | None = None,
+    chunk_size: int = 100_000,
+) -> Iterator[ModelDt]:
+    """
+    Same as the geodesic path in _decimate, but loads chunks of locations into
+    numpy arrays and computes haversine distances from the last emitted point
+    to a window of upcoming points at a time
+
+    Haversine treats the earth as a sphere, so distances differ from the geodesic
+    (WGS-84 ellipsoid) ones by up to ~0.5%. So, the only points which may differ
+    from the geodesic path are ones within ~0.5m of the default 100m
+    new_point_distance threshold (after which, the following points may differ as well)
+    """
+    import numpy as np
+    import more_itertools
+
+    new_dist, new_point_distance = _decimate_thresholds()
+    max_seconds = new_point_distance.total_seconds()
+
+    for chunk in more_itertools.chunked(locs, chunk_size):
+        n = len(chunk)
+        lats = np.radians(np.fromiter((lc.lat for lc in chunk), float, n))
+        lons = np.radians(np.fromiter((lc.lon for lc in chunk), float, n))
+        epochs = np.fromiter((lc.dt.timestamp() for lc in chunk), float, n)
+
+        i = 0
+        if last is None:
+            last = _serialize(chunk[0])
+            yield last
+            i = 1
+        last_lat, last_lon = np.radians(last.lat), np.radians(last.lon)
+        last_epoch = last.dt.timestamp()
+
+        # check small windows after the last point first, doubling the window
+        # each time nothing in it is far enough away, so that computing
+        # distances is roughly linear in the number of points
+        window = 64
+        while i < n:
+            j = min(i + window, n)
+            sin_dlat = np.sin((lats[i:j] - last_lat) / 2)
+            sin_dlon = np.sin((lons[i:j] - last_lon) / 2)
+            a = sin_dlat**2 + np.cos(last_lat) * np.cos(lats[i:j]) * sin_dlon**2
+            dist = 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+            moved = (dist > new_dist) | (epochs[i:j] - last_epoch > max_seconds)
+            k = int(np.argmax(moved))
+            if moved[k]:
+                idx = i + k
+                last = _serialize(chunk[idx])
+                yield last
+                last_lat, last_lon, last_epoch = lats[idx], lons[idx], epochs[idx]
+                i = idx + 1
+                window = 64
+            else:
+                i = j
+                window = min(window * 2, chunk_size)
+
+
+def generate_from_locations(
+    method: DistanceMethod | None = None,
+) -> Iterator[ModelDt]:
+    yield from _decimate(_accurate_locations(), method=method)
 
 
 @cache
@@ -134,19 +288,35 @@ def _homes(reverse: bool = False) -> list[tuple[datetime, LatLon]]:
     return hist
 
 
+@cache
+def _home_index() -> tuple[list[float], list[ModelDt]]:
+    """home history, as sorted epochs and the home that starts at each"""
+    homes = _homes()
+    return (
+        [dt.timestamp() for dt, _ in homes],
+        [ModelDt(lat, lon, _naive(dt)) for dt, (lat, lon) in homes],
+    )
+
+
+def _home_span(epoch: float) -> tuple[ModelDt, float, float]:
+    """
+    given an epoch, give my home at the time, and the range
+    of epochs [start, end) that I lived there
+    """
+    epochs, models = _home_index()
+    idx = bisect.bisect_right(epochs, epoch)
+    if idx == 0:
+        # default to last home
+        return models[-1], float("-inf"), epochs[0]
+    end = epochs[idx] if idx < len(epochs) else float("inf")
+    return models[idx - 1], epochs[idx - 1], end
+
+
 def _home(on_dt: datetime) -> ModelDt:
     """
     given a datetime, give the location/date of my home at the time
     """
-    ndt = _naive(on_dt)
-    for dt, (lat, lon) in _homes(reverse=True):
-        if ndt >= _naive(dt):
-            return ModelDt(lat, lon, _naive(dt))
-
-    # default to last home
-    last = _homes()[-1]
-    ldt, (llon, llat) = last
-    return ModelDt(llat, llon, _naive(ldt))
+    return _home_span(on_dt.timestamp())[0]
 
 
 def _naive(dt: datetime) -> datetime:
@@ -154,15 +324,18 @@ def _naive(dt: datetime) -> datetime:
     return datetime.fromtimestamp(dt.timestamp())
 
 
-def generate() -> Iterator[ModelDt]:
-    import more_itertools
-
+def _group_by_day(points: Iterable[ModelDt]) -> Mapping[date, list[ModelDt]]:
     # relate each item to a day, and add that to a list
     # if none present on that day, default to my home location
     loc_on_day: Mapping[date, list[ModelDt]] = defaultdict(list)
-    for loc in generate_from_locations():
+    for loc in points:
         _, _, dt = loc
         loc_on_day[dt.date()].append(loc)
+    return loc_on_day
+
+
+def _start_datetime(loc_on_day: Mapping[date, list[ModelDt]]) -> datetime:
+    import more_itertools
 
     # start at the first date available + 1 day to account for weird timezone stuff
     cur: datetime = _naive(_homes()[0][0]) + timedelta(days=1)
@@ -174,44 +347,260 @@ def generate() -> Iterator[ModelDt]:
         assert isinstance(
             cur, datetime
         ), f"error extracting dt from first location {loc_on_day[first_key]}"
+    return cur
+
 
+def _walk_days(
+    loc_on_day: Mapping[date, list[ModelDt]],
+    cur: datetime,
     # if we've had some accurate locations, use
     # those for a week instead of home
-    last_accurate: ModelDt | None = None
-
+    last_accurate: ModelDt | None = None,
+) -> Iterator[tuple[ModelDt, bool]]:
+    """
+    Walks a day at a time from cur, yielding each point and whether
+    or not it was a fallback (i.e., not from an accurate location)
+    """
     # go past one day, in case of timezone-issues
     tomorrow = datetime.now() + timedelta(days=1)
+    one_day = timedelta(days=1)
+
+    cutoff = config.accurate_date_cutoff
+    previous_days = config.previous_accurate_for_days
 
     # loop through a day at a time, either using home
     # or using the dates generated from locations
     while cur <= tomorrow:
-        # if we dont have accurate up to date locations
-        if cur.date() not in loc_on_day:
+        if cur.date() in loc_on_day:
+            # we have accurate locations, use those
+            for aloc in loc_on_day[cur.date()]:
+                yield aloc, False
+                # save current accurate location so we can estimate if we want
+                last_accurate = aloc
+            cur += one_day
+            continue
+
+        # if we dont have accurate up to date locations, fill in the run of days
+        # till we have data again. last_accurate can't change during the run, and
+        # the home is only looked up again once we've moved past when I lived there
+        last_accurate_naive = (
+            _naive(last_accurate.dt) if last_accurate is not None else None
+        )
+        home: ModelDt | None = None
+        home_start, home_end = 0.0, 0.0
+        while cur <= tomorrow and cur.date() not in loc_on_day:
             # continue using last accurate timestamp/location till we have a new one
             # or its been config.previous_accurate_for_days (how long we should keep using
             # an old location if were missing data) days since the last accurate one
             if (
-                config.previous_accurate_for_days is not None
-                and config.accurate_date_cutoff is not None
+                previous_days is not None
+                and cutoff is not None
                 and last_accurate is not None
+                and last_accurate_naive is not None
                 and (
-                    cur.date() >= config.accurate_date_cutoff
-                    or abs((cur - _naive(last_accurate.dt)).days)
-                    < config.previous_accurate_for_days
+                    cur.date() >= cutoff
+                    or abs((cur - last_accurate_naive).days) < previous_days
                 )
             ):
-                yield ModelDt(last_accurate.lat, last_accurate.lon, cur)
+                yield ModelDt(last_accurate.lat, last_accurate.lon, cur), True
             else:
                 # else, fallback to use home location
-                last_home = _home(cur)
-                yield ModelDt(last_home.lat, last_home.lon, cur)
+                epoch = cur.timestamp()
+                if home is None or not home_start <= epoch < home_end:
+                    home, home_start, home_end = _home_span(epoch)
+                yield ModelDt(home.lat, home.lon, cur), True
+            cur += one_day
+
+
+def generate(method: DistanceMethod | None = None) -> Iterator[ModelDt]:
+    loc_on_day = _group_by_day(generate_from_locations(method=method))
+    for loc, _ in _walk_days(loc_on_day, _start_datetime(loc_on_day)):
+        yield loc
+
+
+# incremental generation
+#
+# to avoid re-processing my entire location history every time the database
+# is updated, 'gen --incremental' saves a checkpoint next to the database. On the
+# next run, only locations newer than the per-source high-water marks are
+# processed, and only the days after the last accurate location are re-generated.
+# older data added to a source later on is not seen, that needs a full 'gen'
+
+
+def _model_to_json(m: ModelDt) -> list[Any]:
+    return [m.lat, m.lon, m.dt.isoformat()]
+
+
+def _model_from_json(data: list[Any]) -> ModelDt:
+    lat, lon, dt = data
+    return ModelDt(lat, lon, datetime.fromisoformat(dt))
+
+
+@dataclass
+class Checkpoint:
+    # the (naive) datetime we started walking days at
+    start: datetime
+    # last point emitted from _decimate, to continue filtering by distance/duration
+    last_point: ModelDt
+    # last accurate location emitted while walking days
+    last_accurate: ModelDt
+    # epochs of fallback rows generated after last_accurate, these are
+    # removed from the database and re-generated on the next run
+    tail: list[int]
+    # datasource -> epoch of the newest location seen from that source
+    sources: dict[str, float]
+
+    @staticmethod
+    def path_for(db_location: Path) -> Path:
+        return db_location.with_name(f"{db_location.name}.checkpoint.json")
+
+    def dump(self, db_location: Path) -> None:
+        data = {
+            "start": self.start.isoformat(),
+            "last_point": _model_to_json(self.last_point),
+            "last_accurate": _model_to_json(self.last_accurate),
+            "tail": self.tail,
+            "sources": self.sources,
+        }
+        Checkpoint.path_for(db_location).write_text(json.dumps(data))
+
+    @classmethod
+    def load(cls, db_location: Path) -> "Checkpoint | None":
+        cp = Checkpoint.path_for(db_location)
+        if not cp.exists():
+            return None
+        try:
+            data = json.loads(cp.read_text())
+            return cls(
+                start=datetime.fromisoformat(data["start"]),
+                last_point=_model_from_json(data["last_point"]),
+                last_accurate=_model_from_json(data["last_accurate"]),
+                tail=[int(e) for e in data["tail"]],
+                sources={str(k): float(v) for k, v in data["sources"].items()},
+            )
+        except (ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Could not load checkpoint from {cp}, ignoring: {e}")
+            return None
+
+
+def _generate_rows(
+    locs: Iterable[Location],
+    sources: dict[str, float],
+    resume: Checkpoint | None = None,
+    method: DistanceMethod | None = None,
+) -> tuple[list[ModelRaw], Checkpoint | None]:
+    """
+    Generates database rows from sorted locations, returning the rows and
+    a checkpoint to continue from. If resume is passed, the locations are
+    assumed to all be newer than the resume checkpoint
+    """
+    points = list(
+        _decimate(locs, last=resume.last_point if resume else None, method=method)
+    )
+    loc_on_day = _group_by_day(points)
+
+    last_point: ModelDt | None = points[-1] if points else None
+    last_accurate: ModelDt | None = None
+    if resume is None:
+        if not points:
+            return [], None
+        start = _start_datetime(loc_on_day)
+        cur = start
+    else:
+        start = resume.start
+        last_point = last_point or resume.last_point
+        last_accurate = resume.last_accurate
+        # re-walk the day of the last accurate location, or the day after
+        # if there are no new points on that day (it has already been written)
+        last_day = last_accurate.dt.date()
+        cur = start + timedelta(days=(last_day - start.date()).days)
+        if last_day not in loc_on_day:
+            cur += timedelta(days=1)
+
+    rows: list[ModelRaw] = []
+    tail: list[int] = []
+    for loc, fallback in _walk_days(loc_on_day, cur, last_accurate):
+        epoch = int(loc.dt.timestamp())
+        rows.append((loc.lat, loc.lon, epoch))
+        if fallback:
+            tail.append(epoch)
         else:
-            # we have accurate locations, use those
-            for aloc in loc_on_day[cur.date()]:
-                yield aloc
-                # save current accurate location so we can estimate if we want
-                last_accurate = aloc
-        cur += timedelta(days=1)
+            last_accurate = loc
+            tail.clear()
+
+    if last_point is None or last_accurate is None:
+        return rows, None
+    return rows, Checkpoint(
+        start=start,
+        last_point=last_point,
+        last_accurate=last_accurate,
+        tail=tail,
+        sources=sources,
+    )
+
+
+def _generate_full(db_location: Path, method: DistanceMethod | None = None) -> None:
+    sources: dict[str, float] = {}
+    rows, checkpoint = _generate_rows(
+        _accurate_locations(sources), sources, method=method
+    )
+    write_database(rows, db_location)
+    if checkpoint is not None:
+        checkpoint.dump(db_location)
+    else:
+        Checkpoint.path_for(db_location).unlink(missing_ok=True)
+
+
+def generate_incremental(
+    db_location: Path, method: DistanceMethod | None = None
+) -> None:
+    """
+    Updates the binary database at db_location, only processing locations
+    that are newer than the last checkpoint. Falls back to re-generating
+    everything if there is no checkpoint, or if a source has new data that
+    is newer than its own high-water mark but from before the last point
+
+    Locations at or before a source's high-water mark are always skipped, so if
+    a source gains older data (e.g. a new google takeout that fills in gaps before
+    its previous newest location), that isn't picked up -- run 'gen' without
+    --incremental to regenerate the database from scratch
+    """
+    checkpoint = Checkpoint.load(db_location)
+    if (
+        checkpoint is None
+        or not db_location.exists()
+        or not _is_binary_database(db_location)
+    ):
+        logger.info("No checkpoint/binary database found, generating entire database")
+        return _generate_full(db_location, method=method)
+
+    sources = dict(checkpoint.sources)
+    locs = list(_accurate_locations(sources))
+    if locs and locs[0].dt.timestamp() <= checkpoint.last_point.dt.timestamp():
+        logger.info(
+            f"Found new location from before checkpoint ({locs[0]}), generating entire database"
+        )
+        return _generate_full(db_location, method=method)
+
+    new_rows, new_checkpoint = _generate_rows(
+        locs, sources, resume=checkpoint, method=method
+    )
+    assert new_checkpoint is not None
+
+    # remove the fallback rows we generated past the last accurate
+    # location last time, those days have been re-generated above
+    remove = Counter(checkpoint.tail)
+    kept: list[ModelRaw] = []
+    for row in reversed(MmapDatabase(db_location)):
+        if remove[row[2]] > 0:
+            remove[row[2]] -= 1
+        else:
+            kept.append(row)
+    kept.reverse()
+    logger.info(f"Kept {len(kept)} rows, adding {len(new_rows)} new rows")
+
+    write_database(kept + new_rows, db_location)
+    new_checkpoint.dump(db_location)
 
 
 # CLI
@@ -220,12 +609,112 @@ import click
 
 
 # Run 'hpi query my.location.where_db.gen'
-def gen() -> Iterator[ModelRaw]:
-    for loc in generate():
+def gen(method: DistanceMethod | None = None) -> Iterator[ModelRaw]:
+    for loc in generate(method=method):
         yield loc.lat, loc.lon, int(loc.dt.timestamp())
 
 
-Database = list[ModelRaw]
+Database = Sequence[ModelRaw]
+
+# binary database format:
+# an 8 byte header, followed by little-endian (lat: f64, lon: f64, epoch: i64)
+# records, sorted by epoch
+MAGIC = b"WHEREDB\x01"
+RECORD = struct.Struct("<ddq")
+
+
+class MmapDatabase(Sequence[ModelRaw]):
+    """
+    A read-only view of the binary database, using mmap so that
+    only the pages we actually touch while bisecting are read from disk
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not a binary where_db database")
+            size = os.fstat(f.fileno()).st_size
+            self._buf: mmap.mmap | bytes
+            if size > len(MAGIC):
+                self._buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                # cant mmap an empty file
+                self._buf = b""
+        self._len = max(size - len(MAGIC), 0) // RECORD.size
+
+    def __len__(self) -> int:
+        return self._len
+
+    def _record(self, index: int) -> ModelRaw:
+        if index < 0:
+            index += self._len
+        if not 0 <= index < self._len:
+            raise IndexError(f"database index {index} out of range")
+        lat, lon, epoch = RECORD.unpack_from(
+            self._buf, len(MAGIC) + index * RECORD.size
+        )
+        return lat, lon, epoch
+
+    @overload
+    def __getitem__(self, index: int) -> ModelRaw:
+        """the record at index"""
+
+    @overload
+    def __getitem__(self, index: slice) -> list[ModelRaw]:
+        """the records in the slice"""
+
+    def __getitem__(self, index: int | slice) -> ModelRaw | list[ModelRaw]:
+        if isinstance(index, slice):
+            return [self._record(i) for i in range(*index.indices(self._len))]
+        return self._record(index)
+
+
+def _is_binary_database(path: Path) -> bool:
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def load_database(db_location: Path) -> Database:
+    """
+    Loads the database, memory-mapping it if its the binary format,
+    else falling back to parsing the JSON export
+    """
+    if _is_binary_database(db_location):
+        return MmapDatabase(db_location)
+    with open(db_location) as f:
+        data = json.load(f)
+        assert isinstance(data, list)
+    return [(lat, lon, epoch) for lat, lon, epoch in data]
+
+
+def write_database(
+    items: Iterable[ModelRaw], db_location: Path | None, fmt: str = "binary"
+) -> None:
+    """
+    Writes the database, to stdout if db_location is None
+
+    When writing to a file, writes to a temporary file and then
+    renames it over the database, so readers never see a partial file
+    """
+    rows: list[ModelRaw] = list(items)
+    if fmt == "binary":
+        # stable sort, so items at the same second stay in generated order
+        rows.sort(key=lambda r: r[2])
+        data = bytearray(MAGIC)
+        for lat, lon, epoch in rows:
+            data += RECORD.pack(lat, lon, epoch)
+        blob = bytes(data)
+    else:
+        blob = json.dumps(rows).encode()
+
+    if db_location is None:
+        sys.stdout.buffer.write(blob)
+        sys.stdout.buffer.flush()
+        return
+
+    with atomic_write(db_location, "wb") as f:
+        f.write(blob)
 
 
 def _db() -> Path | None:
@@ -242,34 +731,48 @@ def locations(db_location: Path | None = None) -> Iterator[ModelRaw]:
             "No database found -- set one on your where_db config as 'database_location'"
         )
         return
-    with open(db_location) as f:
-        data = json.load(f)
-        assert isinstance(data, list)
-    yield from iter(data)
+    yield from iter(load_database(db_location))
 
 
-def _parse_datetimes(
-    ctx: click.Context, param: click.Argument, value: Sequence[str]
-) -> Iterator[int]:
+def _parse_datetime(d: str) -> int:
     import dateparser
     import warnings
 
     # remove pytz warning from dateparser module
     warnings.filterwarnings("ignore", "The localize method is no longer necessary")
 
+    ds = d.strip()
+    if len(ds) == 0:
+        raise ValueError("Received empty string as input")
+    dt = dateparser.parse(ds)
+    if dt is None:
+        raise ValueError(f"Could not parse '{d}' into a date")
+    return int(dt.timestamp())
+
+
+def _parse_datetimes(
+    ctx: click.Context, param: click.Argument, value: Sequence[str]
+) -> Iterator[int]:
     for d in value:
-        ds = d.strip()
-        if len(ds) == 0:
-            raise click.BadParameter("Received empty string as input")
-        dt = dateparser.parse(ds)
-        if dt is None:
-            raise click.BadParameter(f"Could not parse '{d}' into a date")
-        else:
-            yield int(dt.timestamp())
+        try:
+            yield _parse_datetime(d)
+        except ValueError as e:
+            raise click.BadParameter(str(e))
+
+
+def _parse_datetime_option(
+    ctx: click.Context, param: click.Parameter, value: str | None
+) -> int | None:
+    if value is None:
+        return None
+    try:
+        return _parse_datetime(value)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
 
 
 def _parse_timedelta(
-    ctx: click.Context, param: click.Argument, value: str | None
+    ctx: click.Context, param: click.Parameter, value: str | None
 ) -> timedelta | None:
     if value is None:
         return None
@@ -301,6 +804,7 @@ def _run_query(
     epoch: int,
     db: Database,
     around: timedelta | None = None,
+    every: timedelta | None = None,
 ) -> Iterator[ModelRaw]:
     if epoch < db[0][2]:
         medium(
@@ -310,18 +814,70 @@ def _run_query(
         return
 
     if around is None:
-        for loc in db:
-            if loc[2] >= epoch:
-                yield loc
-                return
+        # first location at or after the epoch
+        idx = bisect.bisect_left(db, epoch, key=lambda loc: loc[2])
+        if idx < len(db):
+            yield db[idx]
+            return
 
         medium("Matched no timestamp, returning most recent location")
         yield db[-1]
     else:
         seconds = around.total_seconds()
-        for loc in db:
-            if abs(loc[2] - epoch) <= seconds:
-                yield loc
+        yield from _run_range(
+            math.ceil(epoch - seconds), math.floor(epoch + seconds), db=db, every=every
+        )
+
+
+def _run_range(
+    start: int,
+    end: int,
+    db: Database,
+    every: timedelta | None = None,
+) -> Iterator[ModelRaw]:
+    """
+    Locations between start and end (inclusive), found by binary searching
+    the sorted epochs. If every is provided, only returns at most
+    one location per that duration
+    """
+    lo = bisect.bisect_left(db, start, key=lambda loc: loc[2])
+    hi = bisect.bisect_right(db, end, key=lambda loc: loc[2])
+    step = every.total_seconds() if every is not None else None
+    next_epoch: float | None = None
+    for i in range(lo, hi):
+        loc = db[i]
+        if step is not None:
+            if next_epoch is not None and loc[2] < next_epoch:
+                continue
+            next_epoch = loc[2] + step
+        yield loc
+
+
+def _run_batch_query(epochs: Sequence[int], db: Database) -> list[ModelRaw]:
+    """
+    Resolves many epochs at once, like _run_query (without around). Sorts the epochs
+    and walks the database once alongside them, returning results in the original order
+    """
+    res: list[ModelRaw | None] = [None] * len(epochs)
+    n = len(db)
+    j = 0
+    for i in sorted(range(len(epochs)), key=lambda i: epochs[i]):
+        # advance to the first location at or after the epoch
+        while j < n and db[j][2] < epochs[i]:
+            j += 1
+        # if we matched no timestamp, use the most recent location
+        res[i] = db[j] if j < n else db[-1]
+    return [r for r in res if r is not None]
+
+
+def _parse_batch_line(line: str) -> int:
+    ls = line.strip()
+    if ls.isdigit():
+        return int(ls)
+    try:
+        return int(datetime.fromisoformat(ls).timestamp())
+    except ValueError:
+        return _parse_datetime(ls)
 
 
 @click.group(help=__doc__)
@@ -329,6 +885,54 @@ def main() -> None:
     pass
 
 
+@main.command(name="gen", short_help="generate database")
+@click.option(
+    "-f",
+    "--format",
+    "fmt",
+    type=click.Choice(["binary", "json"]),
+    default="binary",
+    show_default=True,
+    help="database format to write",
+)
+@click.option(
+    "-o",
+    "--output",
+    type=click.Path(dir_okay=False, path_type=Path),
+    default=None,
+    help="file to write the database to, writes to STDOUT if not provided",
+)
+@click.option(
+    "-i",
+    "--incremental",
+    is_flag=True,
+    default=False,
+    help="only process new location data, using a checkpoint saved next to the database. doesn't pick up older data added to a source",
+)
+@click.option(
+    "-m",
+    "--distance-method",
+    "method",
+    type=click.Choice(get_args(DistanceMethod)),
+    default=None,
+    help="exact 'geodesic' distance or fast numpy 'haversine' approximation, overrides config",
+)
+def gen_cmd(
+    fmt: str, output: Path | None, incremental: bool, method: DistanceMethod | None
+) -> None:
+    """
+    Generates the database from my location data
+    """
+    if incremental:
+        if output is None or fmt != "binary":
+            raise click.UsageError(
+                "--incremental requires --output and the binary format"
+            )
+        generate_incremental(output, method=method)
+    else:
+        write_database(gen(method=method), output, fmt=fmt)
+
+
 @main.command(short_help="query database")
 @click.option(
     "--db",
@@ -360,14 +964,43 @@ def main() -> None:
     callback=_parse_timedelta,
     default=None,
 )
-@click.argument(
-    "DATE", type=click.UNPROCESSED, callback=_parse_datetimes, required=True, nargs=-1
+@click.option(
+    "--start",
+    type=click.UNPROCESSED,
+    callback=_parse_datetime_option,
+    default=None,
+    help="return all locations between --start and --end",
+)
+@click.option(
+    "--end",
+    type=click.UNPROCESSED,
+    callback=_parse_datetime_option,
+    default=None,
+    help="return all locations between --start and --end",
+)
+@click.option(
+    "-e",
+    "--every",
+    type=click.UNPROCESSED,
+    callback=_parse_timedelta,
+    default=None,
+    help="with --around or --start/--end, return at most one location per this duration",
+)
+@click.option(
+    "--offline/--online",
+    default=None,
+    help="only use cached answers when geolocating (defaults to HPI_GEOCODE_OFFLINE)",
 )
+@click.argument("DATE", type=click.UNPROCESSED, callback=_parse_datetimes, nargs=-1)
 def query(
     db: Path,
     use_location: tuple[float, float] | None,
     output: Sequence[str],
     around: timedelta | None,
+    start: int | None,
+    end: int | None,
+    every: timedelta | None,
+    offline: bool | None,
     date: Iterable[int],
 ) -> None:
     """
@@ -375,36 +1008,50 @@ def query(
     """
     dts = list(date)
     output_fmts = set(output)
+    is_range = start is not None or end is not None
+    if is_range and (start is None or end is None):
+        raise click.UsageError("--start and --end must be used together")
+    if not is_range and not dts:
+        raise click.UsageError("Must provide a DATE or --start/--end")
     # if providing a location, default to now
     if use_location is not None:
         dts = [int(time.time())]
-    res: list[ModelRaw]
-    for d in dts:
-        if use_location is None:
-            res = list(_run_query(d, db=list(locations(db)), around=around))
+    # print the timestamp alongside each location when there are multiple per query
+    show_ts = around is not None or is_range
+    results: list[list[ModelRaw]] = []
+    if use_location is not None:
+        results = [[(use_location[0], use_location[1], d)] for d in dts]
+    else:
+        database = load_database(db)
+        if start is not None and end is not None:
+            results = [list(_run_range(start, end, db=database, every=every))]
+            if len(results[0]) == 0:
+                medium(f"No locations found between {fts(start)} and {fts(end)}")
+        for d in [] if is_range else dts:
+            res = list(_run_query(d, db=database, around=around, every=every))
             if len(res) == 0 and around is not None:
                 medium(f"No locations found {around} around timestamp {fts(d)}")
-        else:
-            res = [(use_location[0], use_location[1], d)]
+            results.append(res)
+    geocoder: GeocodeCache | None = None
+    for res in results:
         for lat, lon, ts in res:
             if "plain" in output_fmts:
-                if around:
+                if show_ts:
                     click.echo(f"{fts(ts)} {lat},{lon}")
                 else:
                     click.echo(f"{lat},{lon}")
             if "google_url" in output_fmts:
                 click.echo(f"https://www.google.com/search?q={lat}%2C{lon}")
             if "geolocate" in output_fmts:
-                import geopy.geocoders  # type: ignore[import]
-
-                nom = geopy.geocoders.Nominatim(
-                    user_agent="purarue/HPI-personal/where_db",
+                if geocoder is None:
+                    geocoder = GeocodeCache(offline=offline)
+                info = geocoder.reverse(
+                    lat, lon, user_agent="purarue/HPI-personal/where_db", timeout=3
                 )
-                info = nom.reverse((lat, lon), timeout=3)  # type: ignore
-                click.echo(str(info))
-                # only sleep if we're making more than one request
-                if len(res) > 1 or len(dts) > 1:
-                    time.sleep(1)
+                if info is None:
+                    medium(f"Could not reverse geocode {lat},{lon}")
+                else:
+                    click.echo(info.get("display_name", str(info)))
 
         if "json" in output_fmts:
             from my.core.serialize import dumps
@@ -412,5 +1059,165 @@ def query(
             click.echo(dumps([ModelDt(lat, lon, fts(ts)) for lat, lon, ts in res]))
 
 
+@main.command(short_help="query lots of timestamps at once")
+@click.option(
+    "--db",
+    help="read from database",
+    type=click.Path(exists=True, path_type=Path, dir_okay=False),
+    required=True,
+    default=_db(),
+)
+@click.argument("INPUT", type=click.File("r"), default="-")
+def batch(db: Path, input: TextIO) -> None:
+    """
+    Reads one timestamp (epoch or date-like string) per line from
+    INPUT (defaults to STDIN), and prints a JSON line with the location
+    for each, in the same order
+
+    Useful to annotate lots of events (e.g. listens, photos) with locations
+    """
+    inputs: list[str] = []
+    epochs: list[int] = []
+    for lineno, line in enumerate(input, 1):
+        if not line.strip():
+            continue
+        try:
+            epochs.append(_parse_batch_line(line))
+        except ValueError as e:
+            raise click.BadParameter(f"line {lineno}: {e}")
+        inputs.append(line.strip())
+
+    database = load_database(db)
+    if len(database) == 0:
+        raise click.ClickException(f"No locations in database {db}")
+    res = _run_batch_query(epochs, database)
+    out = sys.stdout
+    for inp, (lat, lon, ts) in zip(inputs, res, strict=True):
+        out.write(
+            json.dumps({"input": inp, "lat": lat, "lon": lon, "epoch": ts}) + "\n"
+        )
+    out.flush()
+
+
+# server, see my.location.where_db_client
+
+
+@cache
+def _parse_around(value: str) -> timedelta:
+    from my.core.query_range import parse_timedelta_string
+
+    return parse_timedelta_string(value)
+
+
+class _ReloadingDatabase:
+    """
+    Keeps the database loaded, re-loading it if the file changes
+
+    gen writes the database by renaming a new file over the old one,
+    so any old mmap stays valid while its being replaced here
+    """
+
+    def __init__(self, db_location: Path) -> None:
+        self.db_location = db_location
+        self._mtime: int | None = None
+        self._db: Database = []
+        self._lock = threading.Lock()
+
+    def get(self) -> Database:
+        mtime = os.stat(self.db_location).st_mtime_ns
+        if mtime != self._mtime:
+            with self._lock:
+                if mtime != self._mtime:
+                    logger.info(f"Loading database from {self.db_location}")
+                    self._db = load_database(self.db_location)
+                    self._mtime = mtime
+        return self._db
+
+
+class _QueryHandler(socketserver.StreamRequestHandler):
+    """
+    Each line is a JSON request like {"query": "yesterday" | epoch, "around": "1h" | null}
+    or {"start": ..., "end": ..., "every": "10m" | null} for a range of locations,
+    responds with a JSON line {"result": [[lat, lon, epoch], ...]} or {"error": "..."}
+    """
+
+    server: "_QueryServer"
+
+    def handle(self) -> None:
+        for line in self.rfile:
+            try:
+                req = json.loads(line)
+                result = (
+                    self.server.answer_range(req)
+                    if "start" in req
+                    else self.server.answer(req)
+                )
+                resp: dict[str, Any] = {"result": result}
+            except Exception as e:
+                resp = {"error": f"{type(e).__name__}: {e}"}
+            self.wfile.write(json.dumps(resp).encode() + b"\n")
+
+
+class _QueryServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path: str, db: _ReloadingDatabase) -> None:
+        self.db = db
+        super().__init__(socket_path, _QueryHandler)
+
+    def answer(self, req: dict[str, Any]) -> list[ModelRaw]:
+        when = req["query"]
+        epoch = when if isinstance(when, int) else _parse_datetime(str(when))
+        around = _parse_around(req["around"]) if req.get("around") else None
+        every = _parse_around(req["every"]) if req.get("every") else None
+        return list(_run_query(epoch, db=self.db.get(), around=around, every=every))
+
+    def answer_range(self, req: dict[str, Any]) -> list[ModelRaw]:
+        start, end = (
+            e if isinstance(e, int) else _parse_datetime(str(e))
+            for e in (req["start"], req["end"])
+        )
+        every = _parse_around(req["every"]) if req.get("every") else None
+        return list(_run_range(start, end, db=self.db.get(), every=every))
+
+
+@main.command(short_help="serve queries over a unix socket")
+@click.option(
+    "--db",
+    help="read from database",
+    type=click.Path(exists=True, path_type=Path, dir_okay=False),
+    required=True,
+    default=_db(),
+)
+@click.option(
+    "-s",
+    "--socket",
+    "socket_path",
+    type=click.Path(dir_okay=False),
+    default=default_socket_path(),
+    show_default=True,
+    help="path to the unix socket to listen on",
+)
+def serve(db: Path, socket_path: str) -> None:
+    """
+    Keeps the database loaded and answers queries over a unix socket,
+    so scripts can do lots of lookups without paying the startup cost
+
+    Query it with 'python3 -m my.location.where_db_client'
+    """
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    rdb = _ReloadingDatabase(db)
+    rdb.get()
+    with _QueryServer(socket_path, rdb) as server:
+        click.echo(f"Listening on {socket_path}", err=True)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.unlink(socket_path)
+
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,159 @@
+"""
+A thin client for 'python3 -m my.location.where_db serve'
+
+This only uses the standard library (it doesn't import my.config, click, dateparser etc.),
+so it starts quickly, and the server keeps the database loaded between queries
+
+python3 -m my.location.where_db_client 'yesterday' '2020-01-05 10:00'
+python3 -m my.location.where_db_client --start '3 days ago' --end 'yesterday' --every 1h
+
+Or, from python, to issue lots of lookups over one connection:
+
+with Client() as c:
+    for epoch in epochs:
+        lat, lon, ts = c.query(epoch)[0]
+"""
+
+import os
+import sys
+import json
+import socket
+import argparse
+import tempfile
+from typing import Any
+from collections.abc import Iterator
+from datetime import datetime
+
+# (lat, lon, epoch)
+ModelRaw = tuple[float, float, int]
+
+
+def default_socket_path() -> str:
+    if runtime_dir := os.environ.get("XDG_RUNTIME_DIR"):
+        return os.path.join(runtime_dir, "where_db.sock")
+    return os.path.join(tempfile.gettempdir(), f"where_db-{os.getuid()}.sock")
+
+
+class Client:
+    def __init__(self, socket_path: str | None = None) -> None:
+        self.socket_path = socket_path or default_socket_path()
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.connect(self.socket_path)
+        self._file = self._sock.makefile("rwb")
+
+    def request(self, data: dict[str, Any]) -> Any:
+        self._file.write(json.dumps(data).encode() + b"\n")
+        self._file.flush()
+        line = self._file.readline()
+        if not line:
+            raise ConnectionError(f"Server at {self.socket_path} closed the connection")
+        resp = json.loads(line)
+        if "error" in resp:
+            raise ValueError(resp["error"])
+        return resp["result"]
+
+    def query(
+        self, when: str | int, around: str | None = None, every: str | None = None
+    ) -> list[ModelRaw]:
+        """
+        when can be an epoch, or any date-like string (parsed by the server)
+        around is a duration like '1h', to return all locations around that time,
+        if every is a duration like '10m', returns at most one location per that duration
+        """
+        return [
+            (lat, lon, epoch)
+            for lat, lon, epoch in self.request(
+                {"query": when, "around": around, "every": every}
+            )
+        ]
+
+    def range(
+        self, start: str | int, end: str | int, every: str | None = None
+    ) -> list[ModelRaw]:
+        """
+        All locations between start and end, if every is a duration like '10m',
+        returns at most one location per that duration
+        """
+        return [
+            (lat, lon, epoch)
+            for lat, lon, epoch in self.request(
+                {"start": start, "end": end, "every": every}
+            )
+        ]
+
+    def close(self) -> None:
+        self._file.close()
+        self._sock.close()
+
+    def __enter__(self) -> "Client":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("DATE", nargs="*", help="date-like strings or epochs to query")
+    parser.add_argument("-a", "--around", default=None, help="e.g. 1h, 30m")
+    parser.add_argument(
+        "--start", default=None, help="return all locations between --start and --end"
+    )
+    parser.add_argument(
+        "--end", default=None, help="return all locations between --start and --end"
+    )
+    parser.add_argument(
+        "-e",
+        "--every",
+        default=None,
+        help="with --around or --start/--end, return at most one location per this duration",
+    )
+    parser.add_argument(
+        "-s", "--socket", default=None, help="path to the where_db serve socket"
+    )
+    parser.add_argument("-j", "--json", action="store_true", help="print JSON lines")
+    args = parser.parse_args()
+    is_range = args.start is not None or args.end is not None
+    if is_range and (args.start is None or args.end is None):
+        parser.error("--start and --end must be used together")
+    if not is_range and not args.DATE:
+        parser.error("Must provide a DATE or --start/--end")
+
+    try:
+        client = Client(args.socket)
+    except OSError as e:
+        print(
+            f"Could not connect to server, start one with 'python3 -m my.location.where_db serve': {e}",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+
+    def _when(d: str) -> str | int:
+        return int(d) if d.isdigit() else d
+
+    def _results(client: Client) -> Iterator[list[ModelRaw]]:
+        if is_range:
+            yield client.range(_when(args.start), _when(args.end), every=args.every)
+        else:
+            for d in args.DATE:
+                yield client.query(_when(d), around=args.around, every=args.every)
+
+    # print the timestamp alongside each location when there are multiple per query
+    show_ts = args.around is not None or is_range
+    with client:
+        try:
+            for res in _results(client):
+                for lat, lon, ts in res:
+                    if args.json:
+                        print(json.dumps([lat, lon, ts]))
+                    elif show_ts:
+                        print(f"{datetime.fromtimestamp(ts)} {lat},{lon}")
+                    else:
+                        print(f"{lat},{lon}")
+        except ValueError as e:
+            print(str(e), file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+"""
+A persistent index of my mpv history from my.mpv.history_daemon, so that
+per-path play/skip counts and play timestamps don't require re-reading
+years of daemon files
+
+Each daemon file is parsed once, and only parsed again if its size/mtime
+changes. Files which are removed (e.g. merged into a larger file by the
+daemon) are removed from the index. The index is kept in the HPI cache
+directory (mpv/plays.sqlite)
+"""
+
+REQUIRES = ["git+https://github.com/purarue/mpv-history-daemon"]
+
+import sqlite3
+from pathlib import Path
+from typing import NamedTuple
+from datetime import datetime, timezone
+from collections.abc import Iterator
+
+from my.core import Stats, make_logger
+from my.utils.cache import cache_db
+from my.utils.parallel import parse_files
+
+logger = make_logger(__name__)
+
+# bump if what is stored for each file changes
+_INDEX_VERSION = 1
+
+# (path, start time epoch, whether it counts as a play)
+_Row = tuple[str, float, bool]
+
+
+class Plays(NamedTuple):
+    path: str
+    plays: int  # times this passed history_daemon's filter, i.e. I listened to it
+    skips: int
+    last_seen: datetime
+
+    @property
+    def score(self) -> int:
+        return self.plays - self.skips
+
+
+class Play(NamedTuple):
+    start_time: datetime
+    path: str
+
+
+def _version() -> str:
+    # what counts as a play depends on my config
+    from my.mpv.history_daemon import config
+
+    return f"{_INDEX_VERSION}:{config.require_percent}"
+
+
+def connect() -> sqlite3.Connection:
+    conn = cache_db("mpv", "plays.sqlite")
+    with conn:
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)"
+        )
+        # pos is the index of the file in history_daemon.inputs()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS files (file TEXT PRIMARY KEY, pos INTEGER, size INTEGER, mtime_ns INTEGER)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS media (file TEXT, path TEXT, start_time REAL, listened INTEGER)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS media_file ON media (file)")
+        row = conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        if row is None or row[0] != _version():
+            conn.execute("DELETE FROM files")
+            conn.execute("DELETE FROM media")
+            conn.execute(
+                "INSERT OR REPLACE INTO meta VALUES ('version', ?)", (_version(),)
+            )
+    return conn
+
+
+def _parse_file(path: Path) -> list[_Row]:
+    from mpv_history_daemon.events import all_history
+    from my.mpv.history_daemon import _filter_by
+
+    return [
+        (m.path, m.start_time.timestamp(), _filter_by(m)) for m in all_history([path])
+    ]
+
+
+def update(conn: sqlite3.Connection) -> int:
+    """
+    Parses any new/changed daemon files into the index, returns how many files were parsed
+    """
+    from my.mpv.history_daemon import inputs
+
+    files = [(str(p), p) for p in inputs()]
+    known: dict[str, tuple[int, int]] = {
+        file: (size, mtime_ns)
+        for file, size, mtime_ns in conn.execute(
+            "SELECT file, size, mtime_ns FROM files"
+        )
+    }
+    current = {file for file, _ in files}
+    misses: list[tuple[str, Path, tuple[int, int]]] = []
+    for file, path in files:
+        st = path.stat()
+        key = (st.st_size, st.st_mtime_ns)
+        if known.get(file) != key:
+            misses.append((file, path, key))
+
+    removed = known.keys() - current
+    if not misses and not removed:
+        return 0
+
+    if misses:
+        logger.debug(f"parsing {len(misses)} new/changed files")
+    parsed = parse_files(_parse_file, [path for _, path, _ in misses], chunksize=16)
+    with conn:
+        for file in removed | {file for file, _, _ in misses}:
+            conn.execute("DELETE FROM media WHERE file = ?", (file,))
+            conn.execute("DELETE FROM files WHERE file = ?", (file,))
+        for (file, _, (size, mtime_ns)), rows in zip(misses, parsed):
+            conn.executemany(
+                "INSERT INTO media VALUES (?, ?, ?, ?)",
+                ((file, *row) for row in rows),
+            )
+            conn.execute(
+                "INSERT INTO files VALUES (?, ?, ?, ?)", (file, 0, size, mtime_ns)
+            )
+        # files which were merged change the order of everything after them
+        conn.executemany(
+            "UPDATE files SET pos = ? WHERE file = ?",
+            ((pos, file) for pos, (file, _) in enumerate(files)),
+        )
+    return len(misses)
+
+
+def _updated() -> sqlite3.Connection:
+    conn = connect()
+    update(conn)
+    return conn
+
+
+def plays() -> Iterator[Plays]:
+    """
+    How many times I've listened to/skipped each path, in
+    the order they first appear in history_daemon.all_history
+    """
+    conn = _updated()
+    query = """
+        SELECT m.path, SUM(m.listened), COUNT(*) - SUM(m.listened), MAX(m.start_time)
+        FROM media m JOIN files f USING (file)
+        GROUP BY m.path
+        ORDER BY MIN(f.pos * 4294967296 + m.rowid)
+    """
+    for path, listened, skipped, last_seen in conn.execute(query):
+        yield Plays(
+            path=path,
+            plays=listened,
+            skips=skipped,
+            last_seen=datetime.fromtimestamp(last_seen, tz=timezone.utc),
+        )
+    conn.close()
+
+
+def history() -> Iterator[Play]:
+    """
+    When I played each thing in history_daemon.history, in the same order
+    """
+    conn = _updated()
+    query = """
+        SELECT m.start_time, m.path
+        FROM media m JOIN files f USING (file)
+        WHERE m.listened
+        ORDER BY f.pos, m.rowid
+    """
+    for start_time, path in conn.execute(query):
+        yield Play(
+            start_time=datetime.fromtimestamp(start_time, tz=timezone.utc), path=path
+        )
+    conn.close()
+
+
+def stats() -> Stats:
+    from my.core import stat
+
+    return {
+        **stat(plays),
+        **stat(history),
+    }
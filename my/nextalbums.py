@@ -17,12 +17,19 @@ class config(user_config):
     export_path: Paths
 
 
+import pickle
 from pathlib import Path
+from functools import cache, lru_cache
+from typing import NamedTuple
+from collections import defaultdict
 from collections.abc import Callable
-from collections.abc import Iterator
+from collections.abc import Iterator, Iterable, Mapping
 
 from nextalbums.export import Album, read_dump
-from my.core import get_files, Stats
+from my.core import get_files, Stats, make_logger
+from my.utils.cache import cache_path, atomic_write
+
+logger = make_logger(__name__, level="warning")
 
 
 # should only ever be one dump, the .job overwrites the file
@@ -33,8 +40,72 @@ def input() -> Path:
     return latest
 
 
+class AlbumIndex(NamedTuple):
+    albums: list[Album]
+    # lowercased genre/style -> indexes into albums
+    genres: dict[str, set[int]]
+    # lowercased reason -> indexes into albums
+    reasons: dict[str, set[int]]
+    # indexes of albums in history/to_listen
+    history: set[int]
+    to_listen: set[int]
+
+
+def _build_index(albums: Iterable[Album]) -> AlbumIndex:
+    index = AlbumIndex([], defaultdict(set), defaultdict(set), set(), set())
+    for i, a in enumerate(albums):
+        index.albums.append(a)
+        for g in a.genres + a.styles:
+            index.genres[g.lower()].add(i)
+        for r in a.reasons:
+            index.reasons[r.lower()].add(i)
+        if a.listened:
+            index.history.add(i)
+        elif not a.dropped:
+            index.to_listen.add(i)
+    return index._replace(genres=dict(index.genres), reasons=dict(index.reasons))
+
+
+# bump if AlbumIndex changes
+_INDEX_VERSION = 1
+
+
+@cache
+def _index() -> AlbumIndex:
+    """
+    The parsed albums, cached to disk (keyed by the path/mtime of the dump),
+    so this doesn't have to re-parse the export every time
+    """
+    dump = input()
+    key = (_INDEX_VERSION, str(dump), dump.stat().st_mtime_ns)
+    cache_file = cache_path("nextalbums", "index.pickle")
+    if cache_file is not None and cache_file.exists():
+        try:
+            with cache_file.open("rb") as f:
+                cached_key, index = pickle.load(f)
+            if cached_key == key and isinstance(index, AlbumIndex):
+                return index
+        except Exception as e:
+            logger.warning(f"Could not load cache from {cache_file}, rebuilding: {e}")
+
+    index = _build_index(read_dump(dump))
+    if cache_file is not None:
+        with atomic_write(cache_file, "wb") as f:
+            pickle.dump((key, index), f, protocol=pickle.HIGHEST_PROTOCOL)
+    return index
+
+
+def _matching(mapping: Mapping[str, set[int]], term: str) -> set[int]:
+    """indexes of albums with any key which contains term"""
+    ids: set[int] = set()
+    for key, album_ids in mapping.items():
+        if term in key:
+            ids |= album_ids
+    return ids
+
+
 def _albums() -> Iterator[Album]:
-    yield from read_dump(input())
+    yield from _index().albums
 
 
 def history() -> Iterator[Album]:
@@ -47,68 +118,132 @@ def to_listen() -> Iterator[Album]:
     yield from filter(lambda a: not a.listened and not a.dropped, _albums())
 
 
-def __getattr__(name: str) -> Callable[[], Iterator[Album]]:
-    """Dynamically create functions for 'hpi query'"""
-    from collections import defaultdict
-
-    save_name = str(name)
-    use_history = name.startswith("history_")
-
-    # use history instead of to listen
-    if use_history:
-        name = name.lstrip("history_")
-
-    use_all = name.startswith("all_")
-
-    if use_all:
-        name = name.lstrip("all_")
-
-    # parse queries that look like:
-    #
-    # genre_rock_reason_fantano
-    # genre_jazz_reason_mu
-    # reason_recommended
-    # reason_manual
-    #
-    # can have multiple genres and reasons
-    # which are ANDed together
-    #
-    # for 'city pop', can do
-    # genre_city_genre_pop
-    #
-    # i.e. this can be with hpi query like:
-    #
-    # hpi query nextalbums.genre_rock_reason_fantano
-    filters = {"genre_", "reason_"}
-    filter_data = defaultdict(list)
-    while any(name.startswith(f) for f in filters):
-        parts = name.split("_")
-        filter_data[parts[0]].append(parts[1])
-        name = "_".join(parts[2:])
-
-    if not filter_data:
-        raise AttributeError(
-            f"Could not create query from or no attribute : {save_name}"
-        )
+class _Term(NamedTuple):
+    # 'genre' or 'reason'
+    kind: str
+    value: str
+    negated: bool
+
+
+class _Query(NamedTuple):
+    # 'history', 'to_listen' or 'all'
+    source: str
+    # the terms in each clause are ANDed, the clauses are ORed
+    clauses: tuple[tuple[_Term, ...], ...]
+
+
+@lru_cache(maxsize=256)
+def _parse_query(name: str) -> _Query:
+    """
+    parse queries that look like:
+
+    genre_rock_reason_fantano
+    genre_jazz_reason_mu
+    reason_recommended
+    reason_manual
+
+    can have multiple genres and reasons which are ANDed together.
+    for 'city pop', can do genre_city_genre_pop
+
+    prefix a term with 'not_' to exclude albums which match it, and
+    separate groups of terms with '_or_' to match any of them, e.g.:
+
+    genre_jazz_or_genre_funk
+    genre_rock_not_genre_metal_or_reason_fantano
+
+    raises ValueError if the name can't be parsed
+    """
+    source = "to_listen"
+    # use history/all instead of to listen
+    for prefix in ("history", "all"):
+        if name.startswith(f"{prefix}_"):
+            source = prefix
+            name = name.removeprefix(f"{prefix}_")
+            break
+
+    parts = name.split("_")
+    clauses: list[tuple[_Term, ...]] = []
+    clause: list[_Term] = []
+    i = 0
+    while i < len(parts):
+        if parts[i] == "or":
+            if not clause:
+                raise ValueError("'or' without a term before it")
+            clauses.append(tuple(clause))
+            clause = []
+            i += 1
+            continue
+        negated = parts[i] == "not"
+        if negated:
+            i += 1
+        if (
+            i + 1 >= len(parts)
+            or parts[i] not in {"genre", "reason"}
+            or not parts[i + 1]
+        ):
+            raise ValueError(
+                f"expected genre_<name> or reason_<name> at {'_'.join(parts[i:])!r}"
+            )
+        clause.append(_Term(parts[i], parts[i + 1], negated))
+        i += 2
+    if not clause:
+        raise ValueError("no terms after the last 'or'" if clauses else "no terms")
+    clauses.append(tuple(clause))
+    return _Query(source, tuple(clauses))
+
+
+def _run_query(query: _Query) -> Iterator[Album]:
+    index = _index()
+    if query.source == "all":
+        base: set[int] = set(range(len(index.albums)))
+    else:
+        base = index.history if query.source == "history" else index.to_listen
+
+    # each distinct term only has to be looked up in the index once
+    matches: dict[tuple[str, str], set[int]] = {}
+    ids: set[int] = set()
+    for clause in query.clauses:
+        clause_ids = set(base)
+        for term in clause:
+            key = (term.kind, term.value)
+            if key not in matches:
+                mapping = index.genres if term.kind == "genre" else index.reasons
+                matches[key] = _matching(mapping, term.value)
+            if term.negated:
+                clause_ids -= matches[key]
+            else:
+                clause_ids &= matches[key]
+        ids |= clause_ids
+
+    for i in sorted(ids):
+        yield index.albums[i]
+
+
+@lru_cache(maxsize=256)
+def _query_func(name: str) -> Callable[[], Iterator[Album]]:
+    query = _parse_query(name)
 
     def _query() -> Iterator[Album]:
-        itr = _albums() if use_all else history() if use_history else to_listen()
+        yield from _run_query(query)
 
-        for genre_filter in filter_data.get("genre", []):
-            itr = filter(
-                lambda a: any(genre_filter in g.lower() for g in a.genres + a.styles),
-                itr,
-            )
+    _query.__name__ = name
+    return _query
 
-        for reason_filter in filter_data.get("reason", []):
-            itr = filter(
-                lambda a: any(reason_filter in r.lower() for r in a.reasons),
-                itr,
-            )
 
-        yield from itr
+def __getattr__(name: str) -> Callable[[], Iterator[Album]]:
+    """
+    Dynamically create functions for 'hpi query', see _parse_query for the syntax
+
+    i.e. this can be with hpi query like:
 
-    return _query
+    hpi query nextalbums.genre_rock_reason_fantano
+    """
+    try:
+        return _query_func(name)
+    except ValueError as e:
+        raise AttributeError(
+            f"Could not create query from or no attribute : {name} ({e})"
+        ) from None
 
 
 def stats() -> Stats:
@@ -19,18 +19,27 @@ class config(user_config):
     export_path: Paths
 
 
+import io
 import os
+import pickle
+import hashlib
 from pathlib import Path
-from collections.abc import Sequence, Iterator
+from functools import cache, partial
+from collections.abc import Sequence, Iterator, Callable
+from typing import Any, TypeVar
 
 from autotui.shortcuts import load_from
 from old_forums.forum import Post  # model from lib
 from old_forums.achievements import AchievementSelector, Achievement
 
 from my.core import get_files, Stats, make_logger
+from my.utils.cache import cache_path, atomic_write
+from my.utils.parallel import parse_files
 
 logger = make_logger(__name__, level="warning")
 
+T = TypeVar("T")
+
 
 def forum_posts_inputs() -> Sequence[Path]:
     return get_files(config.export_path, glob="*.json")
@@ -40,21 +49,124 @@ def achievement_inputs() -> Sequence[Path]:
     return get_files(config.export_path, glob="*.html")
 
 
+# parsed results for each file are cached, keyed by the path/mtime/size of the
+# file (and for achievements, the hash of the selectors file), so only new/changed
+# files have to be parsed. Those are parsed in a process pool
+#
+# bump if the cache format changes
+_CACHE_VERSION = 1
+
+# path -> (key, parsed items)
+_Cache = dict[str, tuple[tuple[Any, ...], list[Any]]]
+
+
+def _cache_file(kind: str) -> Path | None:
+    return cache_path("old_forums", f"{kind}.pickle")
+
+
+def _load_cache(cache_file: Path | None) -> _Cache:
+    if cache_file is None or not cache_file.exists():
+        return {}
+    try:
+        with cache_file.open("rb") as f:
+            version, data = pickle.load(f)
+        if version == _CACHE_VERSION and isinstance(data, dict):
+            return data
+    except Exception as e:
+        logger.warning(f"Could not load cache from {cache_file}, rebuilding: {e}")
+    return {}
+
+
+def _save_cache(cache_file: Path | None, data: _Cache) -> None:
+    if cache_file is None:
+        return
+    with atomic_write(cache_file, "wb") as f:
+        pickle.dump((_CACHE_VERSION, data), f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _cached_parse(
+    kind: str,
+    inputs: Sequence[Path],
+    parse: Callable[[Path], tuple[list[T], str | None]],
+    extra_key: str = "",
+) -> Iterator[T]:
+    """
+    parse is called (in a separate process) for each file which isn't cached,
+    returning the items and an error message, if there was one. Files which
+    errored aren't cached, so the warning is shown on every run
+    """
+    cache_file = _cache_file(kind)
+    cached = _load_cache(cache_file)
+    results: dict[str, list[T]] = {}
+    misses: list[tuple[Path, tuple[Any, ...]]] = []
+    for path in inputs:
+        st = path.stat()
+        key = (st.st_mtime_ns, st.st_size, extra_key)
+        hit = cached.get(str(path))
+        if hit is not None and hit[0] == key:
+            results[str(path)] = hit[1]
+        else:
+            misses.append((path, key))
+
+    if misses:
+        logger.debug(f"{kind}: parsing {len(misses)} new/changed files")
+        parsed = parse_files(parse, [path for path, _ in misses])
+        for (path, key), (items, err) in zip(misses, parsed):
+            results[str(path)] = items
+            if err is None:
+                cached[str(path)] = (key, items)
+            else:
+                logger.warning(f"error parsing {path}: {err}")
+        # drop files which no longer exist
+        _save_cache(cache_file, {p: cached[p] for p in map(str, inputs) if p in cached})
+
+    for path in inputs:
+        yield from results[str(path)]
+
+
+def _parse_posts(path: Path) -> tuple[list[Post], str | None]:
+    return list(load_from(Post, path)), None
+
+
 def forum_posts() -> Iterator[Post]:
-    for path in forum_posts_inputs():
-        yield from load_from(Post, path)
+    yield from _cached_parse("forum_posts", forum_posts_inputs(), _parse_posts)
+
+
+# quite personal, lets me specify CSS selectors as a JSON config file, see:
+# https://github.com/purarue/old_forums
+def _selectors_path() -> Path:
+    return Path(os.environ["OLD_FORUMS_SELECTORS"])
+
+
+@cache
+def _load_selectors(blob: str) -> AchievementSelector:
+    # keyed on the contents, so edits to the file in a long-running process are used
+    return AchievementSelector.load_from_blob(io.StringIO(blob))
+
+
+def _parse_achievements(
+    selectors: str, path: Path
+) -> tuple[list[Achievement], str | None]:
+    sels = _load_selectors(selectors)
+    items: list[Achievement] = []
+    with path.open("r") as f:
+        try:
+            items.extend(Achievement.parse_using_selectors(f, sels))
+        except RuntimeError as e:
+            return items, str(e)
+    return items, None
 
 
 def achievements() -> Iterator[Achievement]:
-    # quite personal, lets me specify CSS selectors as a JSON config file, see:
-    # https://github.com/purarue/old_forums
-    sels = AchievementSelector.load_from_blob(open(os.environ["OLD_FORUMS_SELECTORS"]))
-    for path in achievement_inputs():
-        with path.open("r") as f:
-            try:
-                yield from Achievement.parse_using_selectors(f, sels)
-            except RuntimeError as e:
-                logger.warning(f"error parsing {path}: {e}")
+    selectors = _selectors_path().read_text()
+    # if the selectors change, everything has to be re-parsed
+    sels_hash = hashlib.sha256(selectors.encode()).hexdigest()
+    yield from _cached_parse(
+        "achievements",
+        achievement_inputs(),
+        partial(_parse_achievements, selectors),
+        sels_hash,
+    )
 
 
 def stats() -> Stats:
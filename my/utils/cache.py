@@ -0,0 +1,50 @@
+import os
+import sqlite3
+from pathlib import Path
+from typing import IO, Any
+from contextlib import contextmanager
+from collections.abc import Iterator
+
+from my.core import __NOT_HPI_MODULE__  # noqa: F401
+
+
+def cache_path(*parts: str) -> Path | None:
+    """
+    A path in the HPI cache directory, or None if caching is disabled
+    """
+    from my.core.core_config import config as core_config
+
+    cdir = core_config.get_cache_dir()
+    if cdir is None:
+        return None
+    return Path(cdir).joinpath(*parts)
+
+
+def cache_db(*parts: str) -> sqlite3.Connection:
+    """
+    Connects to an sqlite database in the HPI cache directory. If caching
+    is disabled, the database is in memory, so nothing is kept between runs
+    """
+    path = cache_path(*parts)
+    if path is None:
+        return sqlite3.connect(":memory:")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    return sqlite3.connect(path)
+
+
+@contextmanager
+def atomic_write(path: Path, mode: str = "w") -> Iterator[IO[Any]]:
+    """
+    Writes to a temporary file next to path, which replaces path once the
+    block exits, so readers never see a partially written file
+    """
+    # e.g. kompress.CPath can only be opened for reading
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.tmp")
+    try:
+        with tmp.open(mode) as f:
+            yield f
+        os.replace(tmp, path)
+    finally:
+        tmp.unlink(missing_ok=True)
@@ -0,0 +1,22 @@
+import os
+from pathlib import Path
+from typing import TypeVar
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
+
+from my.core import __NOT_HPI_MODULE__  # noqa: F401
+
+T = TypeVar("T")
+
+
+def parse_files(
+    parse: Callable[[Path], T], paths: list[Path], chunksize: int = 1
+) -> list[T]:
+    """
+    Calls parse on each file, in order. If there's more than one file,
+    they're parsed in a process pool, so parse has to be picklable
+    """
+    if len(paths) <= 1:
+        return [parse(p) for p in paths]
+    with ProcessPoolExecutor(max_workers=min(len(paths), os.cpu_count() or 1)) as pool:
+        return list(pool.map(parse, paths, chunksize=chunksize))
@@ -44,6 +44,8 @@ alias albums-to-listen-desc='albums-next'
 ########################
 
 alias where_db='python3 -m my.location.where_db'
+# query a running 'where_db serve'
+alias where_dbc='python3 -m my.location.where_db_client'
 _wq() {
 	local -a args=()
 	args+=(-o plain -o google_url)
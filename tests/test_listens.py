@@ -0,0 +1,43 @@
+import time
+from datetime import datetime, timezone
+
+import pytest
+
+pytest.importorskip("my_feed")
+
+from my_feed.sources.model import FeedItem
+
+import my.listens
+
+
+def _item(id: str, ts: float) -> FeedItem:
+    return FeedItem(
+        id=id,
+        title=id,
+        ftype="scrobble",
+        when=datetime.fromtimestamp(ts, tz=timezone.utc),
+    )
+
+
+def test_recent_out_of_order(monkeypatch: pytest.MonkeyPatch) -> None:
+    now = time.time()
+    # two mpv instances interleaved, so an item from before the range
+    # comes after ones inside it
+    mpv = [
+        _item("mpv_1", now - 300),
+        _item("mpv_old", now - 7200),
+        _item("mpv_2", now - 100),
+        _item("mpv_3", now - 200),
+    ]
+    offline = [_item("offline_1", now - 250), _item("offline_old", now - 9000)]
+    monkeypatch.setattr(
+        my.listens,
+        "SOURCES",
+        {"mpv": lambda: iter(mpv), "offline_listens": lambda: iter(offline)},
+    )
+    assert [item.id for item in my.listens.recent(3600)] == [
+        "mpv_1",
+        "offline_1",
+        "mpv_3",
+        "mpv_2",
+    ]